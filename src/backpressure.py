@@ -0,0 +1,90 @@
+# integration packages
+import settings
+import logging
+from pipeline import sleep_unless_stopping
+
+import time
+import pika
+
+# start
+logger = logging.getLogger('extract-dspace-backpressure')
+
+
+class ImporterBackpressure:
+    """
+    The ImporterBackpressure class throttles the harvest when the importer cannot keep up.
+
+    The depth of the importer queue is read with a passive declare on a separate channel, because a
+    failing passive declare closes its channel. The harvest pauses when the queue reaches
+    MQ_HIGH_WATERMARK messages and resumes when it has drained to MQ_LOW_WATERMARK. It also pauses
+    while the broker blocks the connection, i.e. because of a memory or disk alarm.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.channel = None
+        self.paused = False
+        self.blocked = False
+        self.depth = None
+        self.checked = 0
+        connection.add_on_connection_blocked_callback(self.on_blocked)
+        connection.add_on_connection_unblocked_callback(self.on_unblocked)
+
+    def on_blocked(self, connection, method_frame):
+        logger.warning('connection blocked by the broker')
+        self.blocked = True
+
+    def on_unblocked(self, connection, method_frame):
+        logger.info('connection unblocked by the broker')
+        self.blocked = False
+
+    def queue_depth(self):
+        """
+        The queue_depth function returns the number of ready messages in the importer queue.
+        The value is cached for MQ_BACKPRESSURE_POLL seconds, so that many sources do not
+        ask the broker for every chunk.
+
+        :return: The number of messages / else None if the queue cannot be inspected
+        """
+        if time.monotonic() - self.checked < settings.MQ_BACKPRESSURE_POLL:
+            return self.depth
+        self.checked = time.monotonic()
+
+        try:
+            if self.channel is None or self.channel.is_closed:
+                self.channel = self.connection.channel()
+            result = self.channel.queue_declare(queue=settings.MQ_IMPORTER_QUEUE, passive=True)
+            self.depth = result.method.message_count
+        except pika.exceptions.ChannelClosedByBroker as e:
+            logger.warning('cannot inspect queue ' + settings.MQ_IMPORTER_QUEUE + ': ' + str(e))
+            self.channel = None
+            self.depth = None
+        return self.depth
+
+    async def wait(self, stopping=None):
+        """
+        The wait function returns as soon as the harvest may fetch the next chunk, or when stopping is set.
+
+        :param stopping: An asyncio.Event that is set on shutdown
+        """
+        if not settings.MQ_IMPORTER_QUEUE:
+            return
+
+        while True:
+            depth = self.queue_depth()
+
+            if depth is not None:
+                if not self.paused and depth >= settings.MQ_HIGH_WATERMARK:
+                    logger.info('pause harvest, ' + str(depth) + ' messages in ' + settings.MQ_IMPORTER_QUEUE)
+                    self.paused = True
+                elif self.paused and depth <= settings.MQ_LOW_WATERMARK:
+                    logger.info('resume harvest, ' + str(depth) + ' messages in ' + settings.MQ_IMPORTER_QUEUE)
+                    self.paused = False
+
+            if not self.paused and not self.blocked:
+                return
+
+            if await sleep_unless_stopping(settings.MQ_BACKPRESSURE_POLL, stopping):
+                return
+            # let pika deliver the unblocked notification
+            self.connection.process_data_events(time_limit=0)
@@ -0,0 +1,53 @@
+# integration packages
+import settings
+import logging
+
+import asyncio
+import json
+from backpressure import ImporterBackpressure
+
+# start
+logger = logging.getLogger('extract-dspace-connections')
+
+
+class SharedConnections:
+    """
+    The SharedConnections class holds the graph database session and the message queue channel
+    that are shared by all harvested sources on one event loop.
+
+    Requests to the graph database are limited by DB_CONCURRENCY. Waiting sources are served in
+    the order they asked, so a large backfill of one source cannot starve the others.
+    The blocking pika channel is only used from the event loop thread. All sources share the
+    backpressure of the importer queue.
+    """
+
+    def __init__(self, session, connection, channel):
+        self.session = session
+        self.connection = connection
+        self.channel = channel
+        self.db_slots = asyncio.Semaphore(settings.DB_CONCURRENCY)
+        self.backpressure = ImporterBackpressure(connection)
+
+    async def execute(self, query, variable_values=None):
+        async with self.db_slots:
+            return await self.session.execute(query, variable_values=variable_values)
+
+    async def wait_for_importer(self, stopping=None):
+        await self.backpressure.wait(stopping)
+
+    def publish(self, routing_key, message):
+        self.channel.basic_publish(
+            settings.MQ_EXCHANGE,
+            routing_key=routing_key,
+            body=json.dumps(message)
+        )
+
+    async def keep_alive(self):
+        """
+        The keep_alive function lets pika process heartbeats while all sources are sleeping,
+        because a blocking connection only handles its events when it is used.
+        """
+        interval = max(1, settings.MQ_HEARTBEAT // 2)
+        while True:
+            await asyncio.sleep(interval)
+            self.connection.process_data_events(time_limit=0)
@@ -0,0 +1,178 @@
+# integration packages
+import settings
+import logging
+import schedule
+
+import json
+import time
+import asyncio
+import pika
+
+# start
+logger = logging.getLogger('extract-dspace-control')
+
+COMMANDS = ['harvest-now', 'harvest-since', 'harvest-set', 'reindex', 'reconcile']
+
+
+def parse_command(body):
+    """
+    The parse_command function reads a control message. A message is either a line of text
+    i.e. `harvest-since 2023-01-01T00:00:00Z` or a json object with command, argument, and an
+    optional source name, i.e. `{"command": "harvest-set", "argument": "com_11475_6"}`.
+
+    :param body: The body of the message
+    :return: A command dictionary / else None if the message is not a valid command
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    body = body.strip()
+
+    if body.startswith('{'):
+        try:
+            message = json.loads(body)
+        except ValueError:
+            return None
+        command = {'command': message.get('command'), 'argument': message.get('argument'), 'source': message.get('source')}
+    else:
+        parts = body.split()
+        if len(parts) == 0:
+            return None
+        command = {'command': parts[0], 'argument': parts[1] if len(parts) > 1 else None, 'source': parts[2] if len(parts) > 2 else None}
+
+    if command['command'] not in COMMANDS:
+        return None
+    if command['command'] not in ['harvest-now', 'reconcile'] and not command['argument']:
+        return None
+    return command
+
+
+class Triggers:
+    """
+    The Triggers class tells every source when to harvest next.
+
+    A source waits for its next command, which is either a command from the control queue, a
+    scheduled harvest-now at the next match of HARVEST_SCHEDULE, i.e. after the update interval
+    of the source if there is no schedule, or a scheduled reconcile at the next match of
+    RECONCILE_SCHEDULE. The update interval counts from the end of the last harvest of the source,
+    so other commands in between do not postpone the next harvest. Commands of a source run in the order they arrived.
+    A command that is already waiting for the same source is dropped. A control message is
+    acknowledged as soon as it is queued, so queued commands do not survive a restart.
+    """
+
+    def __init__(self, sources, connection=None):
+        self.sources = sources
+        self.connection = connection
+        self.channel = None
+        self.queues = {source['name']: asyncio.Queue() for source in sources}
+        self.waiting = set() # (source name, command, argument) of the queued commands
+        self.next_harvest = {} # source name: monotonic time of the next harvest without HARVEST_SCHEDULE
+
+    def enqueue(self, source_name, command):
+        key = (source_name, command['command'], command['argument'])
+        if key in self.waiting:
+            logger.info('drop duplicate ' + command['command'] + ' for ' + source_name)
+            return False
+        self.waiting.add(key)
+        self.queues[source_name].put_nowait(command)
+        return True
+
+    def harvested(self, source):
+        """
+        The harvested function starts the update interval of a source after a harvest.
+        """
+        self.next_harvest[source['name']] = time.monotonic() + source['update_interval']
+
+    def get_target_sources(self, command):
+        if command['source'] is not None:
+            return [source for source in self.sources if source['name'] == command['source']]
+        if command['command'] == 'reindex':
+            # only the source that created the link can reindex it
+            return [source for source in self.sources
+                    if command['argument'].startswith(source['link_template'].format(handle=''))][:1]
+        return self.sources
+
+    def dispatch(self, command):
+        """
+        The dispatch function queues a command for its sources.
+
+        :return: True if at least one source runs the command / else False
+        """
+        target_sources = self.get_target_sources(command)
+        for source in target_sources:
+            self.enqueue(source['name'], command)
+        return len(target_sources) > 0
+
+    async def next_command(self, source, stopping=None):
+        """
+        The next_command function waits for the next command of a source.
+
+        :param source: The source dictionary
+        :param stopping: An asyncio.Event that is set on shutdown
+        :return: The command dictionary / else None if stopping is set
+        """
+        if source['name'] not in self.next_harvest:
+            self.harvested(source)
+        interval = max(self.next_harvest[source['name']] - time.monotonic(), 0)
+        scheduled = [(schedule.seconds_until_next_run(settings.HARVEST_SCHEDULE, interval), 'harvest-now')]
+        if settings.RECONCILE_SCHEDULE:
+            scheduled.append((schedule.seconds_until_next_run(settings.RECONCILE_SCHEDULE, None), 'reconcile'))
+        timeout, scheduled_command = min(scheduled)
+
+        get_command = asyncio.ensure_future(self.queues[source['name']].get())
+        waits = {get_command}
+        if stopping is not None:
+            waits.add(asyncio.ensure_future(stopping.wait()))
+        done, pending = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for wait in pending:
+            wait.cancel()
+
+        if get_command in done:
+            return self.dequeued(source, get_command.result())
+        if len(done) > 0:
+            return None
+
+        command = {'command': scheduled_command, 'argument': None, 'source': source['name']}
+        self.dispatch(command)
+        return self.dequeued(source, self.queues[source['name']].get_nowait())
+
+    def dequeued(self, source, command):
+        # a running command is no longer waiting, so the same command may be queued again while it runs
+        self.waiting.discard((source['name'], command['command'], command['argument']))
+        return command
+
+    async def consume(self):
+        """
+        The consume function polls the control queue on the shared connection and dispatches
+        its commands. The queue is bound to MQ_EXCHANGE with MQ_CONTROL_ROUTING_KEY.
+
+        A message is acknowledged right away, because a harvest can run for hours and the broker
+        closes a channel that holds a message longer than its consumer_timeout. The order of the
+        commands is kept by the queues of the sources. If the channel fails, i.e. because the
+        exchange is missing, the error is logged and the channel is opened again after MQ_CONTROL_POLL.
+        """
+        while True:
+            try:
+                if self.channel is None or self.channel.is_closed:
+                    self.channel = self.connection.channel()
+                    self.channel.queue_declare(queue=settings.MQ_CONTROL_QUEUE, durable=True)
+                    self.channel.queue_bind(queue=settings.MQ_CONTROL_QUEUE, exchange=settings.MQ_EXCHANGE, routing_key=settings.MQ_CONTROL_ROUTING_KEY)
+
+                method, properties, body = self.channel.basic_get(settings.MQ_CONTROL_QUEUE, auto_ack=False)
+                if method is None:
+                    await asyncio.sleep(settings.MQ_CONTROL_POLL)
+                    continue
+                self.channel.basic_ack(method.delivery_tag)
+            except pika.exceptions.AMQPError as e:
+                logger.error('cannot read control queue ' + settings.MQ_CONTROL_QUEUE + ': ' + repr(e))
+                self.channel = None
+                await asyncio.sleep(settings.MQ_CONTROL_POLL)
+                continue
+
+            command = parse_command(body)
+            if command is None:
+                logger.warning('ignore invalid control message: ' + repr(body))
+                continue
+
+            logger.info('received ' + command['command'] + ' ' + str(command['argument'] or ''))
+            if not self.dispatch(command):
+                logger.warning('no source for ' + command['command'] + ' ' + str(command['argument'] or ''))
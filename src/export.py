@@ -0,0 +1,134 @@
+# integration packages
+import settings
+import logging
+import sources
+import pipeline
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# start
+logger = logging.getLogger('extract-dspace-export')
+
+# year and department are the hive partitions of the files, so they are not stored as columns
+SCHEMA = pa.schema([
+    ('link', pa.string()),
+    ('title', pa.string()),
+    ('abstract', pa.string()),
+    ('date_update', pa.string()),
+    ('language', pa.string()),
+    ('category', pa.string()),
+    ('subtype', pa.string()),
+    ('authors', pa.list_(pa.string())),
+    ('keywords', pa.list_(pa.string())),
+    ('classes', pa.list_(pa.struct([('id', pa.string()), ('name', pa.string())]))),
+    ('departments', pa.list_(pa.string())),
+    ('source', pa.string())
+])
+
+
+def gen_export_row(record_dict, source_name):
+    """
+    The gen_export_row function flattens a record dictionary of gen_record_dict into a row of the export.
+
+    :param record_dict: The dictionary of the record
+    :param source_name: Name of the source of the record
+    :return: (partition path, row dictionary)
+    """
+    departments = [department['id'] for department in record_dict['departments']]
+    # a record is stored once, in the partition of its first department
+    partition = os.path.join('year=' + str(record_dict['year']), 'department=' + (departments[0] if len(departments) > 0 else 'none'))
+
+    row = {
+        'link': record_dict['link'],
+        'title': record_dict['title'],
+        'abstract': record_dict['abstract'],
+        'date_update': record_dict['dateUpdate'],
+        'language': record_dict['language'],
+        'category': record_dict['category']['name'],
+        'subtype': record_dict['subtype']['name'],
+        'authors': [author['fullname'] for author in record_dict['authors']],
+        'keywords': [keyword['name'] for keyword in record_dict['keywords']],
+        'classes': [{'id': record_class['id'], 'name': record_class['name'].strip()} for record_class in record_dict['class']],
+        'departments': departments,
+        'source': source_name
+    }
+    return partition, row
+
+
+class ParquetExporter:
+    """
+    The ParquetExporter class writes record dictionaries as parquet files, partitioned by year
+    and department (i.e. `year=2021/department=department_T/part-....parquet`). The rows of a
+    partition are buffered and written as one file when EXPORT_ROWS_PER_FILE rows are collected
+    or when the exporter is closed. Most partitions never reach that size, so all partitions are
+    also written when together they hold EXPORT_ROWS_PER_FILE rows, which bounds the memory of a replay.
+    """
+
+    def __init__(self, directory, source_name):
+        self.directory = directory
+        self.source_name = source_name
+        self.run_id = time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self.partitions = {}
+        self.buffered = 0
+        self.files = 0
+
+    def add(self, record_dicts):
+        for record_dict in record_dicts:
+            partition, row = gen_export_row(record_dict, self.source_name)
+            rows = self.partitions.setdefault(partition, [])
+            rows.append(row)
+            self.buffered += 1
+            if len(rows) >= settings.EXPORT_ROWS_PER_FILE:
+                self.write(partition)
+            elif self.buffered >= settings.EXPORT_ROWS_PER_FILE:
+                self.write_all()
+
+    def write(self, partition):
+        rows = self.partitions.pop(partition, [])
+        if len(rows) == 0:
+            return
+        self.buffered -= len(rows)
+        os.makedirs(os.path.join(self.directory, partition), exist_ok=True)
+        path = os.path.join(self.directory, partition, 'part-' + self.run_id + '-' + str(self.files).zfill(5) + '.parquet')
+        pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), path, compression=settings.EXPORT_COMPRESSION)
+        self.files += 1
+
+    def write_all(self):
+        for partition in list(self.partitions):
+            self.write(partition)
+
+    def close(self):
+        self.write_all()
+        logger.info('exported ' + str(self.files) + ' files of ' + self.source_name + ' to ' + self.directory)
+
+
+async def replay(source_names=None):
+    """
+    The replay function harvests the sources from the beginning into a new parquet snapshot
+    `EXPORT_DIR/snapshot_<time>`. It does not touch the graph database, the message queue,
+    or the watermarks.
+
+    :param source_names: Names of the sources to export / else None for all sources
+    """
+    directory = os.path.join(settings.EXPORT_DIR, 'snapshot_' + time.strftime('%Y%m%dT%H%M%S'))
+
+    for source in sources.get_sources():
+        if source_names and source['name'] not in source_names:
+            continue
+        logger.info('replay ' + source['name'] + ' into ' + directory)
+        exporter = ParquetExporter(directory, source['name'])
+        result = await pipeline.run_pipeline(None, source, {}, exporter=exporter, write_graph=False)
+        await asyncio.to_thread(exporter.close)
+        if not result['complete']:
+            logger.error('incomplete replay of ' + source['name'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(levelname)s: %(name)s: %(asctime)s: %(message)s", level=settings.LOG_LEVEL)
+    asyncio.run(replay(sys.argv[1:]))
@@ -5,22 +5,21 @@ import logging
 # packaeges for dgraph and OAI interface
 import requests
 import re
+import asyncio
 from bs4 import BeautifulSoup
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
-import json
+from gql import gql
 
 # start
 logger = logging.getLogger('extract-dspace')
 
 
-async def get_last_dgraph_update_timestamp(client):
+async def get_last_dgraph_update_timestamp(connections):
     """
     The get_last_dgraph_update_timestamp function returns the last time that Dgraph was updated.
     It does this by querying the dgraph database for a queryInfoObject with a dateUpdate field, and then returning 
     the value of that field.
     
-    :param client: Access the dgraph api
+    :param connections: Shared connections to access the dgraph api
     :return: The date of the last update to the dgraph database / else None
     """
     query = gql(
@@ -34,7 +33,7 @@ async def get_last_dgraph_update_timestamp(client):
         }
         """
     )
-    result = await client.execute_async(query)
+    result = await connections.execute(query)
     # print(result)
     if len(result['queryInfoObjectType'][0]["objects"]) > 0:
         return result['queryInfoObjectType'][0]["objects"][0]['dateUpdate']
@@ -42,7 +41,7 @@ async def get_last_dgraph_update_timestamp(client):
         return None
 
 
-def get_single_chunk_oai_records_by_date(oai_url, datestamp=None, resumption_token=None):
+def get_single_chunk_oai_records_by_date(oai_url, datestamp=None, resumption_token=None, until=None, set_spec=None, verb='ListRecords'):
     """
     The get_single_chunk_oai_records_by_date function takes a URL for an OAI-PMH endpoint,
     a datestamp (in the form YYYY-MM-DD), and optionally a resumption token. 
@@ -53,6 +52,9 @@ def get_single_chunk_oai_records_by_date(oai_url, datestamp=None, resumption_tok
     :param oai_url: Specify the oai-pmh endpoint of the repository
     :param datestamp: Specify a date from which to retrieve the records i.e. '2023-01-13'
     :param resumption_token: Retrieve the next chunk of records
+    :param until: Optionally, the last datestamp (inclusive) of the records
+    :param set_spec: Optionally, the set of the records
+    :param verb: ListRecords, or ListIdentifiers for the headers only
     :return: A beautifulsoup object containing the xml response
     """
 
@@ -61,16 +63,79 @@ def get_single_chunk_oai_records_by_date(oai_url, datestamp=None, resumption_tok
 
     if resumption_token is None: # no resumtion token, so get first chunk
         params = {'metadataPrefix': 'oai_dc', 'from': datestamp} # The metadataPrefix - a string to specify the metadata format in OAI-PMH requests issued to the repository
+        if until is not None:
+            params['until'] = until
+        if set_spec is not None:
+            params['set'] = set_spec
     else: # there is a resumption token, so get the next chunk
         params= {'resumptionToken': resumption_token}
 
-    params['verb'] = 'ListRecords'
+    params['verb'] = verb
     resp = requests.get(oai_url, params=params)
     oaixml = BeautifulSoup(resp.content, "lxml-xml")
 
     return oaixml
 
 
+def get_single_oai_record(oai_url, identifier):
+    """
+    The get_single_oai_record function requests a single record from the OAI-PMH endpoint.
+
+    :param oai_url: Specify the oai-pmh endpoint of the repository
+    :param identifier: The oai identifier of the record i.e. 'oai:digitalcollection.zhaw.ch:11475/1234'
+    :return: A beautifulsoup object containing the xml response
+    """
+    params = {'verb': 'GetRecord', 'metadataPrefix': 'oai_dc', 'identifier': identifier}
+    resp = requests.get(oai_url, params=params)
+    oaixml = BeautifulSoup(resp.content, "lxml-xml")
+
+    return oaixml
+
+
+def get_earliest_datestamp(oai_url):
+    """
+    The get_earliest_datestamp function asks the OAI-PMH endpoint for the datestamp of its oldest record.
+
+    :param oai_url: Specify the oai-pmh endpoint of the repository
+    :return: The earliest datestamp / else None
+    """
+    resp = requests.get(oai_url, params={'verb': 'Identify'})
+    oaixml = BeautifulSoup(resp.content, "lxml-xml")
+    if oaixml.earliestDatestamp is None:
+        return None
+    return oaixml.earliestDatestamp.get_text().strip()
+
+
+def get_resumption_token(oaixml):
+    """
+    The get_resumption_token function returns the resumption token of an OAI-PMH response.
+    The last chunk of a list carries an empty resumptionToken element, which is treated like a missing token.
+
+    :param oaixml: A beautifulsoup object containing the xml response
+    :return: The resumption token / else None if there are no more chunks
+    """
+    if oaixml.resumptionToken is None:
+        return None
+    token = oaixml.resumptionToken.get_text().strip()
+    if len(token) == 0:
+        return None
+    return token
+
+
+def get_oai_error(oaixml):
+    """
+    The get_oai_error function returns the error code of an OAI-PMH response.
+    The code noRecordsMatch is not an error for the harvester, it only tells that nothing has changed.
+
+    :param oaixml: A beautifulsoup object containing the xml response
+    :return: The error code / else None
+    """
+    error = oaixml.find('error')
+    if error is None or error.get('code') == 'noRecordsMatch':
+        return None
+    return error.get('code', 'unknown')
+
+
 def get_entity_from_xml_record_entity(record, entity):
     """
     The get_entity_from_xml_record_entity function is used to get a specific entry from the xml record.
@@ -90,13 +155,14 @@ def get_entity_from_xml_record_entity(record, entity):
     return entity_list
 
 
-def get_deptcollection_from_xml_record_entity(record):
+def get_deptcollection_from_xml_record_entity(record, department_collections):
     """
     The get_deptcollection_from_xml_record_entity function is used to extract the department from a record's header.
-    It uses a lookup table from settings.py to map the collection id  to the internal department label. The 
+    It uses the lookup table of the source to map the collection id  to the internal department label. The 
     result is a list of department associations. Any collection that is not mapped is ignored. 
     
     :param record: The xml record entity
+    :param department_collections: Lookup table from collection id to department label
     :return: A list of mapped department relations for the specific entry
     """
     entity = 'setSpec' 
@@ -106,23 +172,24 @@ def get_deptcollection_from_xml_record_entity(record):
     if len(record.header.find_all(entity)) > 0: 
         for i in range(len(record.header.find_all(entity))):
             entity_content = "".join(record.header.find_all(entity)[i].contents)
-            if entity_content in settings.DepartmentCollections:
-                entity_list.append({ "id": settings.DepartmentCollections[entity_content] })
+            if entity_content in department_collections:
+                entity_list.append({ "id": department_collections[entity_content] })
 
     return entity_list
 
-def gen_record_dict(record):
+def gen_record_dict(record, source):
     """
-    The gen_record_dict function takes a single XML record from the ZHAW Digital
-    Collection and returns a dictionary with all of its information. The function
-    takes one argument, which is an xml.etree object representing the record in 
-    question.
+    The gen_record_dict function takes a single XML record from a DSpace repository
+    such as the ZHAW Digital Collection and returns a dictionary with all of its information.
+    The record is an xml.etree object, the source provides the link template and the
+    department mapping of the repository.
     
     :param record: xml record from the oai-api
+    :param source: The source dictionary of the repository
     :return: A dictionary that can be used to create a new publication in the graph database
     """
 
-    record_department_list = get_deptcollection_from_xml_record_entity(record)
+    record_department_list = get_deptcollection_from_xml_record_entity(record, source['department_collections'])
     
     # get information from the xml record
     record_identifier_list = record.header.identifier.contents
@@ -155,7 +222,7 @@ def gen_record_dict(record):
     record_keyword_list = [subject for subject in record_dc_subject_list if re.match('\d\d\d: ', subject) is None]
 
     # get url to the record in the digital collection
-    record_url = 'https://digitalcollection.zhaw.ch/handle/' + record_identifier_list[0].split(':')[-1]
+    record_url = source['link_template'].format(handle=record_identifier_list[0].split(':')[-1])
 
     # get language of the record, use simply first entry
     record_language = record_dc_language_list[0]
@@ -188,17 +255,32 @@ def gen_record_dict(record):
     }
     return record_dict
 
-async def add_records_to_graphdb_with_updateDate(oaixml, client, channel):
+def gen_chunk_record_dicts(oaixml, source):
     """
-    The add_records_to_graphdb function takes in a chunk of records and adds them to the graphdb database.
+    The gen_chunk_record_dicts function extracts the information of all records in a chunk.
+    Deleted records are only counted.
+
     :param oaixml: A chunk of records
-    :return: (# of inserted records, # of deleted records)
+    :param source: The source dictionary of the repository
+    :return: (list of record dictionaries, # of deleted records)
     """
-    
-    inserted_records = 0
+    record_dicts = []
     deleted_records = 0
 
-    my_query = """
+    for record in oaixml.find_all('record'):
+        # check header if record is deleted ... indicated by tag: status = deleted
+        if len(record.header.attrs) > 0:
+            if record.header['status'] == 'deleted':
+                # print('Record is deleted')
+                deleted_records += 1
+                continue
+
+        record_dicts.append(gen_record_dict(record, source))  # extract information for current record
+
+    return record_dicts, deleted_records
+
+
+ADD_INFO_OBJECT_QUERY = gql("""
     mutation addInfoObject($record: [AddInfoObjectInput!]!) { 
         addInfoObject(input: $record, upsert: true) {
             infoObject { 
@@ -206,72 +288,61 @@ async def add_records_to_graphdb_with_updateDate(oaixml, client, channel):
             } 
         } 
     }
-    """
+    """)
 
-    recquery = gql(my_query)
 
-    # add chunk of records to the database
-    for record in oaixml.find_all('record'):
-        # check header if record is deleted ... indicated by tag: status = deleted
-        record_deleted = False
-        if len(record.header.attrs) > 0:
-            if record.header['status'] == 'deleted':
-                # print('Record is deleted')
-                record_deleted = True
-                deleted_records += 1
+async def add_record_dict_to_graphdb(record_dict, connections):
+    """
+    The add_record_dict_to_graphdb function upserts a single record into the graphdb database.
 
-        if not record_deleted:  
-            record_dict = gen_record_dict(record)  # extract information for current record
+    :param record_dict: The dictionary of the record
+    :param connections: Shared connections to the graph database
+    :return: The result of the mutation
+    """
+    result = await connections.execute(ADD_INFO_OBJECT_QUERY, variable_values = {"record": [record_dict]})
+    logger.debug(result)
+    return result
 
-            result = await client.execute_async(recquery, variable_values = {"record": [record_dict]})
 
-            logger.debug(result)
+def publish_record_dict(record_dict, connections):
+    connections.publish("importer.object", { "link": record_dict["link"] })
 
-            channel.basic_publish(
-                settings.MQ_EXCHANGE,
-                routing_key="importer.object",
-                body=json.dumps({ "link": record_dict["link"] })
-            )
-            
-            inserted_records += 1
-    return inserted_records, deleted_records
 
+async def add_records_to_graphdb_with_updateDate(oaixml, connections, source):
+    """
+    The add_records_to_graphdb function takes in a chunk of records and adds them to the graphdb database.
+    :param oaixml: A chunk of records
+    :param connections: Shared connections to the graph database and the message queue
+    :param source: The source dictionary of the repository
+    :return: (# of inserted records, # of deleted records)
+    """
+    record_dicts, deleted_records = gen_chunk_record_dicts(oaixml, source)
 
-async def run(channel, resumption_token=None):
-    logger.info("run service function")
+    for record_dict in record_dicts:
+        await add_record_dict_to_graphdb(record_dict, connections)
+        publish_record_dict(record_dict, connections)
 
-    oai_url = settings.TARGET_HOST + settings.TARGET_PATH #' https://digitalcollection.zhaw.ch/oai/request/' # url to the oai-pmh api
-    graphdb_endpoint = settings.DB_HOST + settings.DB_PATH # 'http://localhost:8080/graphql' # url to the graphdb endpoint
+    return len(record_dicts), deleted_records
 
-    logger.debug(oai_url)
-    logger.debug(graphdb_endpoint)
 
-    transport = AIOHTTPTransport(url=graphdb_endpoint) # Select your transport with a defined url endpoint
-    # Create a GraphQL client using the defined transport
-    client = Client(transport=transport, fetch_schema_from_transport=True)
+async def reindex_record(connections, source, link):
+    """
+    The reindex_record function harvests a single record again and adds it to the graph database.
 
-    # get_last_dgraph_update_timestamp
-    if resumption_token is None:
-        last_update_timestamp = await get_last_dgraph_update_timestamp(client)
-        if last_update_timestamp is not None:
-            logger.info('Last update timestamp in graphDB: ' + last_update_timestamp)
-        else:
-            logger.info('No last update timestamp in graphDB ... default set to 1900-01-01T00:00:00Z')
-    else: 
-        last_update_timestamp = None
-    
-    try: 
-        # chunk of records that have been updated since the last update
-        oaixml = get_single_chunk_oai_records_by_date(oai_url, datestamp=last_update_timestamp, resumption_token=resumption_token)
-        token = oaixml.resumptionToken
-    except:
-        return None
+    :param connections: Shared connections to the graph database and the message queue
+    :param source: The source dictionary of the repository
+    :param link: The link of the record in the repository
+    :return: (# of inserted records, # of deleted records)
+    """
+    handle = link[len(source['link_template'].format(handle='')):]
+    identifier = source['identifier_prefix'] + handle
+    logger.info('reindex ' + identifier)
 
-    # add chunk of records to the database
-    inserted_records, deleted_records = await add_records_to_graphdb_with_updateDate(oaixml, client=client, channel=channel)
+    oaixml = await asyncio.to_thread(get_single_oai_record, source['oai_url'], identifier)
 
-    logger.info('Number of inserted records: ' + str(inserted_records))
-    logger.info('Number of deleted records: ' + str(deleted_records))
-    logger.info('finished service function')
-    return token
-    
\ No newline at end of file
+    error_code = get_oai_error(oaixml)
+    if error_code is not None:
+        logger.error('OAI-PMH error for ' + identifier + ': ' + error_code)
+        return 0, 0
+
+    return await add_records_to_graphdb_with_updateDate(oaixml, connections=connections, source=source)
@@ -0,0 +1,183 @@
+# integration packages
+import settings
+import logging
+
+# packages for the coordination store
+import os
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+
+# start
+logger = logging.getLogger('extract-dspace-leases')
+
+
+class LeaseStore:
+    """
+    The LeaseStore class coordinates the harvest work units of several replicas.
+
+    A unit is pending, leased, or done. A replica claims a pending unit, or a leased unit whose lease
+    has expired, and keeps its lease alive with heartbeats. A unit that is completed for good is
+    never handed out again, a unit that is completed for now becomes pending again after a delay.
+
+    Subclasses provide the transaction that loads and saves the units.
+    """
+
+    @contextmanager
+    def transaction(self):
+        raise NotImplementedError
+
+    def add_units(self, units):
+        """
+        Add work units to the store. Units that are already known keep their state.
+
+        :param units: A list of unit dictionaries with a unique id
+        :return: The number of new units
+        """
+        added = 0
+        with self.transaction() as entries:
+            for unit in units:
+                if unit['id'] not in entries:
+                    entries[unit['id']] = {'unit': unit, 'state': 'pending', 'owner': None, 'expires': 0, 'not_before': 0}
+                    added += 1
+        return added
+
+    def claim(self, owner, ttl, source_name=None):
+        """
+        Lease the oldest claimable unit, optionally only a unit of the given source.
+
+        :param owner: Id of the claiming replica
+        :param ttl: Lifetime of the lease in seconds
+        :param source_name: Name of the source / else None for any source
+        :return: The unit dictionary / else None if there is nothing to do
+        """
+        now = time.time()
+        with self.transaction() as entries:
+            for unit_id in sorted(entries):
+                entry = entries[unit_id]
+                if source_name is not None and entry['unit']['source'] != source_name:
+                    continue
+                claimable = (entry['state'] == 'pending' and entry['not_before'] <= now) or \
+                    (entry['state'] == 'leased' and entry['expires'] <= now)
+                if claimable:
+                    if entry['state'] == 'leased':
+                        logger.warning('lease of ' + unit_id + ' held by ' + entry['owner'] + ' has expired')
+                    entry['state'] = 'leased'
+                    entry['owner'] = owner
+                    entry['expires'] = now + ttl
+                    return entry['unit']
+        return None
+
+    def heartbeat(self, unit_id, owner, ttl):
+        """
+        Extend the lease of a unit.
+
+        :return: True if the lease is still held by the owner / else False
+        """
+        with self.transaction() as entries:
+            entry = entries.get(unit_id)
+            if entry is None or entry['state'] != 'leased' or entry['owner'] != owner:
+                return False
+            entry['expires'] = time.time() + ttl
+            return True
+
+    def complete(self, unit_id, owner, final=True, retry_after=0):
+        """
+        Record the completion of a unit. A final unit is done for good, any other unit
+        becomes pending again after retry_after seconds.
+
+        :return: True if the lease was still held by the owner / else False
+        """
+        with self.transaction() as entries:
+            entry = entries.get(unit_id)
+            if entry is None or entry['state'] != 'leased' or entry['owner'] != owner:
+                return False
+            entry['state'] = 'done' if final else 'pending'
+            entry['owner'] = None
+            entry['expires'] = 0
+            entry['not_before'] = time.time() + retry_after
+            entry['attempts'] = 0
+            return True
+
+    def release(self, unit_id, owner, failed=True):
+        """
+        Give a unit back without completing it. A failed unit becomes pending again after
+        LEASE_POLL_INTERVAL * 2^attempts seconds, at most LEASE_MAX_BACKOFF, so a unit that fails
+        every time does not hold back the later units. A unit that is given back on shutdown is
+        claimable right away.
+
+        :return: True if the lease was still held by the owner / else False
+        """
+        with self.transaction() as entries:
+            entry = entries.get(unit_id)
+            if entry is None or entry['state'] != 'leased' or entry['owner'] != owner:
+                return False
+            retry_after = 0
+            if failed:
+                entry['attempts'] = entry.get('attempts', 0) + 1
+                retry_after = min(settings.LEASE_POLL_INTERVAL * 2 ** entry['attempts'], settings.LEASE_MAX_BACKOFF)
+                logger.warning('retry ' + unit_id + ' in ' + str(retry_after) + ' seconds after ' + str(entry['attempts']) + ' failed attempts')
+            entry['state'] = 'pending'
+            entry['owner'] = None
+            entry['expires'] = 0
+            entry['not_before'] = time.time() + retry_after
+            return True
+
+
+class MemoryLeaseStore(LeaseStore):
+    """
+    The MemoryLeaseStore class keeps the units in the process. It coordinates replicas that run
+    in the same process, i.e. in tests or for a single replica without a shared volume.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            yield self.entries
+
+
+class FileLeaseStore(LeaseStore):
+    """
+    The FileLeaseStore class keeps the units in a json file on a volume that is shared by all replicas.
+    Every transaction holds an exclusive lock on the file, so the volume must support flock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    @contextmanager
+    def transaction(self):
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = {}
+                if os.path.exists(self.path):
+                    with open(self.path) as f:
+                        entries = json.load(f)
+                yield entries
+                tmp_file = self.path + '.tmp'
+                with open(tmp_file, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_file, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_lease_store():
+    """
+    The get_lease_store function returns the coordination store selected by LEASE_STORE.
+
+    :return: A LeaseStore / else None if the work is not split into units
+    """
+    if settings.LEASE_STORE == 'file':
+        return FileLeaseStore(settings.LEASE_FILE)
+    if settings.LEASE_STORE == 'memory':
+        return MemoryLeaseStore()
+    return None
@@ -1,19 +1,97 @@
+import os
 import time
+import socket
+import signal
 import logging
 import settings
+import sources
 import hookup
+import leases
+import workunits
+import pipeline
+import control
+import reconcile
+from profiling import profiler
 import asyncio
 import pika
+from gql import Client
+from gql.transport.aiohttp import AIOHTTPTransport
+from connections import SharedConnections
 
 logging.basicConfig(format="%(levelname)s: %(name)s: %(asctime)s: %(message)s", level=settings.LOG_LEVEL)
 
 logger = logging.getLogger('extract-dspace-loop')
 
-limit_batch = settings.LIMIT_BATCH  # -1, no limit ... process all batches
+limit_batch = settings.LIMIT_BATCH  # -1, no limit ... process all batches per harvest
+
+async def sourceLoop(connections, source, triggers, stopping):
+    command = None # the first harvest starts right away
+
+    while not stopping.is_set():
+        logger.info('start iteration ' + source['name']) # for server logs and profiling, need to run right before the harvest.
+        try:
+            result = await profiler.run(source['name'], pipeline.run_harvest, connections, source, command, stopping, limit_batch) # harvest all chunks and add them to the graph database
+        except Exception:
+            # a failing source must not stop the other sources, the checkpoint is kept for the next harvest
+            logger.exception('failed harvest of ' + source['name'])
+            result = None
+        logger.info('complete iteration ' + source['name']) # for server logs and profiling, need to run right after the harvest.
+
+        triggers.harvested(source) # the update interval starts after the harvest
+
+        if result is not None and not result['complete'] and not stopping.is_set() and limit_batch != -1 and result['chunks'] >= limit_batch:
+            logger.info('stop after ' + str(limit_batch) + ' batches for ' + source['name']) # limit number of batches to be processed
+            break
+
+        # wait for the schedule or the control queue, the other sources keep running
+        command = await triggers.next_command(source, stopping)
+        while command is not None and command['command'] in ['reindex', 'reconcile']:
+            try:
+                if command['command'] == 'reindex':
+                    await hookup.reindex_record(connections, source, command['argument'])
+                else:
+                    await reconcile.run_reconcile(connections, source)
+            except Exception:
+                logger.exception('failed ' + command['command'] + ' for ' + source['name'])
+            command = await triggers.next_command(source, stopping)
+
+async def unitLoop(connections, source, store, stopping):
+    owner = socket.gethostname() + ':' + str(os.getpid()) # id of this replica in the lease store
+    earliest = None
+
+    while not stopping.is_set():
+        if earliest is None:
+            earliest = await asyncio.to_thread(hookup.get_earliest_datestamp, source['oai_url'])
+            if earliest is None:
+                logger.error('no earliest datestamp for ' + source['name'])
+                await pipeline.sleep_unless_stopping(settings.LEASE_POLL_INTERVAL, stopping)
+                continue
+
+        # all replicas plan the same units, units that are already known are left untouched
+        added = store.add_units(workunits.plan_units(source, earliest, time.time()))
+        if added > 0:
+            logger.info('planned ' + str(added) + ' new work units for ' + source['name'])
+
+        unit = store.claim(owner, settings.LEASE_TTL, source['name'])
+        if unit is None:
+            await pipeline.sleep_unless_stopping(settings.LEASE_POLL_INTERVAL, stopping) # nothing to do, wait for due or expired units
+            continue
+
+        logger.info('start iteration ' + unit['id']) # for server logs and profiling
+        await profiler.run(unit['id'], workunits.run_unit, connections, source, store, owner, unit, stopping)
+        logger.info('complete iteration ' + unit['id']) # for server logs and profiling
+
+        await pipeline.sleep_unless_stopping(source['request_interval'], stopping) # wait before asking for the next unit
 
 async def mainLoop():
-    batch_count = 0
-    resumption_token = None
+    # profiling is armed at start or by SIGUSR1
+    profiler.arm(settings.PROFILE_ITERATIONS)
+    profiler.install_signal_handler(asyncio.get_running_loop())
+
+    # on shutdown no more chunks are fetched, the chunks in the pipeline are finished
+    stopping = asyncio.Event()
+    for shutdown_signal in [signal.SIGTERM, signal.SIGINT]:
+        asyncio.get_running_loop().add_signal_handler(shutdown_signal, stopping.set)
 
     connection = pika.BlockingConnection(
         pika.ConnectionParameters(
@@ -25,24 +103,34 @@ async def mainLoop():
     )
     channel = connection.channel()
 
-    while (limit_batch == -1) or (limit_batch > 0 and batch_count < limit_batch): # limit number of batches to be processed:
-        logger.info('start iteration') # for server logs and profiling, need to run right before the hookup.run().
-        resumption_token = await hookup.run(channel, resumption_token) # ask for a batch of records and add them to the graph database
-        logger.info('complete iteration') # for server logs and profiling, need to run right after the hookup.run().
-
-        # house keeping
-        batch_count += 1 # increment batch counter
-        
-        # resumption_token = None if there are no more batches to be processed
-        if resumption_token is None:
-            logger.info('finish iteration after ' + str(batch_count) + ' batches') 
-            sleepTimeout = settings.PUBDB_UPDATE_INTERVAL
-            batch_count = 0 # reset batch counter for
+    graphdb_endpoint = settings.DB_HOST + settings.DB_PATH # 'http://localhost:8080/graphql' # url to the graphdb endpoint
+    logger.debug(graphdb_endpoint)
+
+    transport = AIOHTTPTransport(url=graphdb_endpoint) # Select your transport with a defined url endpoint
+    # Create a GraphQL client using the defined transport, one session is shared by all sources
+    client = Client(transport=transport, fetch_schema_from_transport=True)
+
+    async with client as session:
+        connections = SharedConnections(session, connection, channel)
+
+        keep_alive = asyncio.create_task(connections.keep_alive())
+        source_list = sources.get_sources()
+        store = leases.get_lease_store()
+        if store is None:
+            triggers = control.Triggers(source_list, connection)
+            consumer = asyncio.create_task(triggers.consume()) if settings.MQ_CONTROL_QUEUE else None
+            await asyncio.gather(*[sourceLoop(connections, source, triggers, stopping) for source in source_list])
+            if consumer is not None:
+                consumer.cancel() # queued commands are lost, they have been acknowledged
         else:
-            logger.info('prepare for another batch') 
-            sleepTimeout = settings.OAI_REQUEST_INTERVAL # wait before asking for the next batches
-        
-        time.sleep(sleepTimeout) # wait before asking for the next batches
+            # work units are scheduled by the lease store
+            if settings.MQ_CONTROL_QUEUE:
+                logger.warning('the control queue is not used with work units')
+            await asyncio.gather(*[unitLoop(connections, source, store, stopping) for source in source_list])
+        keep_alive.cancel()
+
+    connection.close()
+    logger.info('stopped')
 
 # run the main loop
 asyncio.run(mainLoop())
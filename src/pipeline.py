@@ -0,0 +1,330 @@
+# integration packages
+import settings
+import logging
+import hookup
+import watermark
+from tracing import tracer
+
+import os
+import json
+import asyncio
+
+# start
+logger = logging.getLogger('extract-dspace-pipeline')
+
+
+async def sleep_unless_stopping(seconds, stopping=None):
+    """
+    The sleep_unless_stopping function waits for the given time, or less if stopping is set.
+
+    :return: True if stopping is set / else False
+    """
+    if stopping is None:
+        await asyncio.sleep(seconds)
+        return False
+    try:
+        await asyncio.wait_for(stopping.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+    return stopping.is_set()
+
+
+async def run_pipeline(connections, source, request, checkpoint=None, stopping=None, limit_batch=-1, exporter=None, write_graph=True):
+    """
+    The run_pipeline function harvests the chunks of a list request in four stages that run concurrently:
+
+    - fetch: requests the chunks one after the other, following the resumption tokens
+    - parse: extracts the record dictionaries of a chunk (PIPELINE_PARSE_WORKERS)
+    - write: upserts the records of a chunk into the graph database (PIPELINE_WRITE_WORKERS)
+    - publish: publishes the records of a chunk to the importer, in the order of the chunks,
+      and adds them to the exporter
+
+    The stages are connected by queues of PIPELINE_QUEUE_SIZE chunks, so a slow stage holds back the
+    stages before it. The checkpoint is called after a chunk and all chunks before it have been
+    published. If it returns False or if stopping is set, no more chunks are fetched and the chunks
+    in the queues are processed before the function returns. Without write_graph the write and the
+    publish to the importer are skipped, i.e. to replay a source into the export only.
+
+    :param connections: Shared connections to the graph database and the message queue
+    :param source: The source dictionary of the repository
+    :param request: A dictionary with the optional keys from, until, set, and resumption_token
+    :param checkpoint: A function that is called with the result and each published chunk
+    :param stopping: An asyncio.Event that is set on shutdown
+    :param limit_batch: The max number of chunks to fetch, -1 for no limit
+    :param exporter: A ParquetExporter for the records / else None
+    :param write_graph: False to skip the graph database and the message queue
+    :return: A result dictionary, complete is True if the whole list has been published
+    """
+    queue_size = settings.PIPELINE_QUEUE_SIZE
+    parse_workers = settings.PIPELINE_PARSE_WORKERS
+    write_workers = settings.PIPELINE_WRITE_WORKERS
+
+    fetched = asyncio.Queue(maxsize=queue_size)
+    parsed = asyncio.Queue(maxsize=queue_size)
+    written = asyncio.Queue(maxsize=queue_size)
+    stop_fetching = asyncio.Event()
+
+    result = {
+        'complete': False,
+        'fetched_all': False,
+        'response_date': None,
+        'error': None,
+        'chunks': 0,
+        'inserted_records': 0,
+        'deleted_records': 0
+    }
+    active = {'parse': parse_workers, 'write': write_workers}
+
+    async def fetch():
+        resumption_token = request.get('resumption_token')
+        number = 0
+        while True:
+            if stop_fetching.is_set() or (stopping is not None and stopping.is_set()):
+                logger.info('stop fetching ' + source['name'] + ' after ' + str(number) + ' chunks')
+                break
+            if limit_batch != -1 and number >= limit_batch:
+                logger.info('stop fetching ' + source['name'] + ' at LIMIT_BATCH')
+                break
+
+            # the span of the chunk ends after the chunk has been published
+            span = tracer.start_span('harvest.chunk', attributes={
+                'source': source['name'],
+                'chunk.number': number,
+                'chunk.cursor': resumption_token or ''
+            })
+
+            # wait while the importer is busy with the records of the previous chunks
+            if write_graph:
+                with tracer.span('importer.wait', parent=span):
+                    await connections.wait_for_importer(stopping)
+                if stopping is not None and stopping.is_set():
+                    logger.info('stop fetching ' + source['name'] + ' after ' + str(number) + ' chunks')
+                    span.end()
+                    break
+
+            try:
+                # the request and the parsing are blocking, so they run in a thread to keep the other stages going
+                with tracer.span('oai.fetch', parent=span, attributes={'oai.url': source['oai_url']}):
+                    oaixml = await asyncio.to_thread(hookup.get_single_chunk_oai_records_by_date, source['oai_url'],
+                                                     datestamp=request.get('from'), resumption_token=resumption_token,
+                                                     until=request.get('until'), set_spec=request.get('set'))
+            except Exception as e:
+                logger.exception('cannot fetch chunk of ' + source['name'])
+                result['error'] = 'fetch'
+                span.record_error(e)
+                span.end()
+                break
+
+            error_code = hookup.get_oai_error(oaixml)
+            if error_code is not None:
+                logger.error('OAI-PMH error for ' + source['name'] + ': ' + error_code)
+                result['error'] = error_code
+                span.set_attribute('oai.error', error_code)
+                span.record_error(error_code)
+                span.end()
+                break
+
+            if result['response_date'] is None:
+                result['response_date'] = oaixml.responseDate.get_text().strip()
+
+            resumption_token = hookup.get_resumption_token(oaixml)
+            await fetched.put({'number': number, 'oaixml': oaixml, 'cursor': resumption_token, 'span': span})
+            number += 1
+
+            if resumption_token is None:
+                result['fetched_all'] = True
+                break
+
+            await sleep_unless_stopping(source['request_interval'], stopping) # wait before asking for the next chunk
+
+        for _ in range(parse_workers):
+            await fetched.put(None)
+
+    async def parse():
+        while (chunk := await fetched.get()) is not None:
+            with tracer.span('parse', parent=chunk['span']) as span:
+                chunk['records'], chunk['deleted'] = await asyncio.to_thread(hookup.gen_chunk_record_dicts, chunk['oaixml'], source)
+                span.set_attribute('record.count', len(chunk['records']))
+            del chunk['oaixml']
+            await parsed.put(chunk)
+        active['parse'] -= 1
+        if active['parse'] == 0:
+            for _ in range(write_workers):
+                await parsed.put(None)
+
+    async def write():
+        while (chunk := await parsed.get()) is not None:
+            for record_dict in chunk['records'] if write_graph else []:
+                with tracer.span('dgraph.mutation', parent=chunk['span'], attributes={'link': record_dict['link']}) as span:
+                    response = await hookup.add_record_dict_to_graphdb(record_dict, connections)
+                    if span.sampled:
+                        span.set_attribute('response.size', len(json.dumps(response)))
+            await written.put(chunk)
+        active['write'] -= 1
+        if active['write'] == 0:
+            await written.put(None)
+
+    async def publish():
+        # the writers finish their chunks in any order, the checkpoints follow the order of the chunks
+        waiting = {}
+        next_number = 0
+        while (chunk := await written.get()) is not None:
+            waiting[chunk['number']] = chunk
+            while next_number in waiting:
+                chunk = waiting.pop(next_number)
+                for record_dict in chunk['records'] if write_graph else []:
+                    with tracer.span('mq.publish', parent=chunk['span'], attributes={'link': record_dict['link']}):
+                        hookup.publish_record_dict(record_dict, connections)
+                if exporter is not None:
+                    with tracer.span('export', parent=chunk['span']):
+                        await asyncio.to_thread(exporter.add, chunk['records'])
+                chunk['span'].set_attribute('record.count', len(chunk['records']))
+                chunk['span'].set_attribute('record.deleted', chunk['deleted'])
+                chunk['span'].end()
+                result['chunks'] += 1
+                result['inserted_records'] += len(chunk['records'])
+                result['deleted_records'] += chunk['deleted']
+                if checkpoint is not None and checkpoint(result, chunk) is False:
+                    stop_fetching.set()
+                next_number += 1
+
+    # an error in one stage cancels the other stages, the error is raised to the caller
+    async with asyncio.TaskGroup() as stages:
+        stages.create_task(fetch())
+        for _ in range(parse_workers):
+            stages.create_task(parse())
+        for _ in range(write_workers):
+            stages.create_task(write())
+        stages.create_task(publish())
+
+    result['complete'] = result['fetched_all'] and result['error'] is None
+    return result
+
+
+async def get_harvest_request(connections, source, command):
+    """
+    The get_harvest_request function returns the list request of a new harvest. A harvest-now command
+    (or no command) resumes an interrupted harvest or starts from the watermark, harvest-since starts
+    from the given datestamp, and harvest-set harvests a set from the beginning.
+
+    :param connections: Shared connections to access the dgraph api
+    :param source: The source dictionary of the repository
+    :param command: The command dictionary that started the harvest / else None
+    :return: A request dictionary for run_pipeline
+    """
+    command_name = command['command'] if command is not None else 'harvest-now'
+
+    if command_name == 'harvest-since':
+        logger.info('Harvest since ' + command['argument'])
+        return {'from': command['argument']}
+
+    if command_name == 'harvest-set':
+        logger.info('Harvest set ' + command['argument'])
+        return {'set': command['argument']}
+
+    cursor = watermark.load_cursor(source['name'])
+    if cursor is not None:
+        logger.info('Resume interrupted harvest of ' + source['name'])
+        return {'resumption_token': cursor}
+
+    # get the watermark of the last committed harvest, fall back to the graph database
+    last_update_timestamp = watermark.load_watermark(source['name'])
+    if last_update_timestamp is not None:
+        logger.info('Last harvest watermark: ' + last_update_timestamp)
+    elif source['graph_fallback']:
+        last_update_timestamp = await hookup.get_last_dgraph_update_timestamp(connections)
+        if last_update_timestamp is not None:
+            logger.info('Last update timestamp in graphDB: ' + last_update_timestamp)
+        else:
+            logger.info('No last update timestamp in graphDB ... default set to 1900-01-01T00:00:00Z')
+    else:
+        logger.info('No harvest watermark ... default set to 1900-01-01T00:00:00Z')
+    return {'from': last_update_timestamp}
+
+
+def moves_harvest_watermark(source, command):
+    """
+    The moves_harvest_watermark function decides if a harvest commits a new watermark.
+
+    :param source: The source dictionary of the repository
+    :param command: The command dictionary that started the harvest / else None
+    :return: True if the harvest covers all changes since the watermark / else False
+    """
+    if command is None or command['command'] == 'harvest-now':
+        return True
+    if command['command'] == 'harvest-since':
+        # iso datestamps compare like strings, a date without time sorts before the same day with time
+        last_watermark = watermark.load_watermark(source['name'])
+        if last_watermark is not None and command['argument'] <= last_watermark:
+            return True
+        logger.info('harvest since ' + command['argument'] + ' does not move the watermark ' + str(last_watermark))
+    return False
+
+
+def is_dead_cursor(result):
+    """
+    The is_dead_cursor function checks if a resumed harvest failed because of its resumption token,
+    i.e. with badResumptionToken or with any OAI-PMH error on the first chunk. A failed request
+    (error 'fetch') keeps the cursor, the repository may only be unreachable.
+    """
+    if result['error'] == 'badResumptionToken':
+        return True
+    return result['error'] not in [None, 'fetch'] and result['chunks'] == 0
+
+
+async def run_harvest(connections, source, command=None, stopping=None, limit_batch=-1):
+    """
+    The run_harvest function harvests a source and adds the records to the graph database.
+    The checkpoint of the watermark is saved after each published chunk, and the watermark is
+    committed after the last chunk. A harvest-set covers only a part of the repository, so it never
+    moves the watermark. A harvest-since only moves it if it starts at or before the watermark,
+    otherwise the records changed between the watermark and its datestamp would be skipped.
+
+    :param connections: Shared connections to the graph database and the message queue
+    :param source: The source dictionary of the repository
+    :param command: The command dictionary that started the harvest / else None
+    :param stopping: An asyncio.Event that is set on shutdown
+    :param limit_batch: The max number of chunks to fetch, -1 for no limit
+    :return: The result dictionary of run_pipeline
+    """
+    logger.info("run service function for " + source['name'])
+
+    request = await get_harvest_request(connections, source, command)
+    moves_watermark = moves_harvest_watermark(source, command)
+
+    if moves_watermark and 'resumption_token' not in request:
+        watermark.begin_harvest(source['name'])
+
+    def checkpoint(result, chunk):
+        if moves_watermark:
+            watermark.save_checkpoint(source['name'], result['response_date'], chunk['cursor'])
+
+    # the updated records are also exported, if there is an export directory
+    exporter = None
+    if settings.EXPORT_DIR:
+        import export # pyarrow is only needed for the export
+        exporter = export.ParquetExporter(os.path.join(settings.EXPORT_DIR, 'updates'), source['name'])
+
+    try:
+        result = await run_pipeline(connections, source, request, checkpoint=checkpoint, stopping=stopping,
+                                    limit_batch=limit_batch, exporter=exporter)
+
+        # an expired resumption token would fail every later harvest, so the harvest starts again from the watermark
+        if 'resumption_token' in request and is_dead_cursor(result):
+            logger.warning('cannot resume harvest of ' + source['name'] + ' (' + result['error'] + '), start again from the watermark')
+            watermark.begin_harvest(source['name'])
+            request = await get_harvest_request(connections, source, command)
+            result = await run_pipeline(connections, source, request, checkpoint=checkpoint, stopping=stopping,
+                                        limit_batch=limit_batch, exporter=exporter)
+    finally:
+        if exporter is not None:
+            await asyncio.to_thread(exporter.close)
+
+    # the harvest is fully committed after the last chunk has been published
+    if result['complete'] and moves_watermark:
+        watermark.commit_harvest(source['name'])
+
+    logger.info('Number of inserted records: ' + str(result['inserted_records']))
+    logger.info('Number of deleted records: ' + str(result['deleted_records']))
+    logger.info('finished service function after ' + str(result['chunks']) + ' chunks')
+    return result
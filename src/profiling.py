@@ -0,0 +1,113 @@
+# integration packages
+import settings
+import logging
+
+# packages for profiling
+import os
+import io
+import time
+import glob
+import signal
+import cProfile
+import pstats
+import tracemalloc
+
+# start
+logger = logging.getLogger('extract-dspace-profiling')
+
+
+class IterationProfiler:
+    """
+    The IterationProfiler class profiles the next N harvest iterations on demand.
+
+    While no iterations are armed, an iteration costs one integer comparison. An armed iteration is
+    run under cProfile and tracemalloc, and the cpu statistics and the memory snapshot are written to
+    PROFILE_DIR. tracemalloc only runs during the profiled iteration, not while waiting for the next
+    one. Only one iteration is profiled at a time, but cProfile and tracemalloc see everything on the
+    event loop thread, so the coroutines of concurrent iterations of other sources are profiled too.
+    The time spent in OAI requests that run in a worker thread shows up as waiting time.
+    """
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self.remaining = 0
+        self.busy = False
+
+    def arm(self, iterations):
+        """
+        Profile the next iterations.
+        """
+        if iterations <= 0:
+            return
+        logger.info('profile the next ' + str(iterations) + ' iterations')
+        self.remaining = iterations
+
+    def install_signal_handler(self, loop):
+        loop.add_signal_handler(signal.SIGUSR1, self.arm, settings.PROFILE_SIGNAL_ITERATIONS)
+
+    async def run(self, name, coro_function, *args):
+        """
+        The run function awaits one iteration, i.e. pipeline.run_harvest, and profiles it if armed.
+
+        :param name: Name of the iteration, used in the file names
+        :param coro_function: The coroutine function of the iteration
+        :return: The result of the iteration
+        """
+        if self.remaining <= 0 or self.busy:
+            return await coro_function(*args)
+
+        self.busy = True
+        self.remaining -= 1
+        profile = cProfile.Profile()
+        tracemalloc.start(settings.PROFILE_TRACEMALLOC_FRAMES)
+        start_snapshot = tracemalloc.take_snapshot()
+        profile.enable()
+        try:
+            return await coro_function(*args)
+        finally:
+            profile.disable()
+            end_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.busy = False
+            try:
+                self.write(name, profile, start_snapshot, end_snapshot)
+            except OSError:
+                logger.exception('cannot write profile of ' + name)
+
+    def write(self, name, profile, start_snapshot, end_snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        prefix = os.path.join(self.directory, time.strftime('%Y%m%dT%H%M%S') + '_' + safe_name)
+
+        # raw statistics for snakeviz or pstats, and a readable summary
+        profile.dump_stats(prefix + '.prof')
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(settings.PROFILE_TOP)
+        with open(prefix + '_cpu.txt', 'w') as f:
+            f.write(summary.getvalue())
+
+        with open(prefix + '_memory.txt', 'w') as f:
+            f.write('top allocations\n')
+            for stat in end_snapshot.statistics('traceback')[:settings.PROFILE_TOP]:
+                f.write(str(stat) + '\n')
+                for line in stat.traceback.format():
+                    f.write('    ' + line + '\n')
+            f.write('\ngrowth during the iteration\n')
+            for stat in end_snapshot.compare_to(start_snapshot, 'lineno')[:settings.PROFILE_TOP]:
+                f.write(str(stat) + '\n')
+
+        logger.info('wrote profile ' + prefix)
+        self.rotate()
+
+    def rotate(self):
+        # every profiled iteration writes three files, keep the files of the newest iterations (none for PROFILE_KEEP=0)
+        files = sorted(glob.glob(os.path.join(self.directory, '*.prof')))
+        for old_file in files[:max(len(files) - self.keep, 0)]:
+            base = old_file[:-len('.prof')]
+            for path in [old_file, base + '_cpu.txt', base + '_memory.txt']:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+profiler = IterationProfiler(settings.PROFILE_DIR, settings.PROFILE_KEEP)
@@ -0,0 +1,235 @@
+# integration packages
+import settings
+import logging
+import hookup
+import watermark
+
+import time
+import json
+import heapq
+import asyncio
+import tempfile
+from gql import gql
+
+# start
+logger = logging.getLogger('extract-dspace-reconcile')
+
+QUERY_GRAPH_LINKS = gql("""
+    query queryLinks($first: Int, $offset: Int) {
+        queryInfoObjectType(filter: { name: { eq: "publications" } }) {
+            objects(first: $first, offset: $offset) {
+                link
+            }
+        }
+    }
+    """)
+
+DELETE_INFO_OBJECTS = gql("""
+    mutation deleteInfoObject($links: [String]) {
+        deleteInfoObject(filter: { link: { in: $links } }) {
+            numUids
+        }
+    }
+    """)
+
+
+class ExternalSorter:
+    """
+    The ExternalSorter class sorts more links than fit into memory. The links are collected in
+    runs of RECONCILE_SORT_CHUNK links, each run is sorted and written to a temporary file, and
+    the runs are merged when the links are read. Duplicate links are returned once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.buffer = []
+        self.runs = []
+
+    def add(self, link):
+        self.buffer.append(link)
+        if len(self.buffer) >= settings.RECONCILE_SORT_CHUNK:
+            self.spill()
+
+    def spill(self):
+        if len(self.buffer) == 0:
+            return
+        self.buffer.sort()
+        run_file = tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False, suffix='.run')
+        with run_file:
+            for link in self.buffer:
+                run_file.write(link + '\n')
+        self.runs.append(run_file.name)
+        self.buffer = []
+
+    def iter_sorted(self):
+        self.spill()
+        files = [open(run) for run in self.runs]
+        try:
+            previous = None
+            for line in heapq.merge(*files):
+                link = line.rstrip('\n')
+                if link != previous:
+                    yield link
+                previous = link
+        finally:
+            for f in files:
+                f.close()
+
+
+def iter_differences(dspace_links, graph_links):
+    """
+    The iter_differences function compares two sorted streams of links without holding them in memory.
+
+    :param dspace_links: Sorted iterator of the links of the active records in DSpace
+    :param graph_links: Sorted iterator of the links of the publications in the graph database
+    :return: A generator of ('missing', link) for links only in DSpace and ('orphan', link) for links only in the graph
+    """
+    dspace_link = next(dspace_links, None)
+    graph_link = next(graph_links, None)
+
+    while dspace_link is not None or graph_link is not None:
+        if graph_link is None or (dspace_link is not None and dspace_link < graph_link):
+            yield 'missing', dspace_link
+            dspace_link = next(dspace_links, None)
+        elif dspace_link is None or graph_link < dspace_link:
+            yield 'orphan', graph_link
+            graph_link = next(graph_links, None)
+        else:
+            dspace_link = next(dspace_links, None)
+            graph_link = next(graph_links, None)
+
+
+def collect_dspace_links(source, sorter, metrics):
+    """
+    The collect_dspace_links function streams all identifiers of the repository (ListIdentifiers)
+    into the sorter. Deleted records are counted but not collected. It runs in a thread.
+    Any failure raises, because an incomplete list would turn records into orphans.
+    """
+    resumption_token = None
+    while True:
+        oaixml = hookup.get_single_chunk_oai_records_by_date(source['oai_url'], resumption_token=resumption_token, verb='ListIdentifiers')
+
+        error_code = hookup.get_oai_error(oaixml)
+        if error_code is not None:
+            raise RuntimeError('OAI-PMH error for ' + source['name'] + ': ' + error_code)
+
+        for header in oaixml.find_all('header'):
+            if header.get('status') == 'deleted':
+                metrics['dspace_deleted'] += 1
+                continue
+            identifier = header.identifier.get_text().strip()
+            sorter.add(source['link_template'].format(handle=identifier.split(':')[-1]))
+            metrics['dspace_records'] += 1
+
+        resumption_token = hookup.get_resumption_token(oaixml)
+        if resumption_token is None:
+            return
+        time.sleep(source['request_interval'])
+
+
+async def collect_graph_links(connections, source, sorter, metrics):
+    """
+    The collect_graph_links function pages through the links of all publications in the graph database
+    and collects the links of the source into the sorter.
+    """
+    prefix = source['link_template'].format(handle='')
+    offset = 0
+    while True:
+        result = await connections.execute(QUERY_GRAPH_LINKS, variable_values={'first': settings.RECONCILE_PAGE_SIZE, 'offset': offset})
+        objects = result['queryInfoObjectType'][0]['objects'] if len(result['queryInfoObjectType']) > 0 else []
+
+        for info_object in objects:
+            if info_object['link'] is not None and info_object['link'].startswith(prefix):
+                sorter.add(info_object['link'])
+                metrics['graph_links'] += 1
+
+        if len(objects) < settings.RECONCILE_PAGE_SIZE:
+            return
+        offset += settings.RECONCILE_PAGE_SIZE
+
+
+async def fix_batch(connections, source, kind, links, metrics, allow_delete):
+    """
+    The fix_batch function deletes a batch of orphans or harvests a batch of missing records again.
+    A missing record that cannot be harvested, i.e. because it cannot be parsed, is counted as failed
+    and does not stop the sweep. Each GetRecord request waits request_interval before it is sent.
+    """
+    if kind == 'orphan':
+        if not allow_delete:
+            return
+        result = await connections.execute(DELETE_INFO_OBJECTS, variable_values={'links': links})
+        metrics['deleted'] += result['deleteInfoObject']['numUids']
+    else:
+        for link in links:
+            await asyncio.sleep(source['request_interval']) # wait between the GetRecord requests, also across batches
+            try:
+                inserted_records, deleted_records = await hookup.reindex_record(connections, source, link)
+                metrics['reindexed'] += inserted_records
+            except Exception:
+                logger.exception('cannot reindex ' + link)
+                metrics['failed'] += 1
+
+
+async def run_reconcile(connections, source):
+    """
+    The run_reconcile function compares the records of a source in DSpace and in the graph database.
+    Publications that are gone from DSpace (orphans) are deleted, records that are missing in the graph
+    are harvested again with GetRecord, both in batches of RECONCILE_BATCH_SIZE. The orphans are only
+    deleted if they are at most RECONCILE_MAX_DELETE_FRACTION of the publications of the source, which
+    protects the graph from a repository that suddenly returns too few identifiers.
+
+    :param connections: Shared connections to the graph database and the message queue
+    :param source: The source dictionary of the repository
+    :return: A dictionary with the metrics of the run
+    """
+    logger.info('reconcile ' + source['name'])
+    started = time.time()
+    metrics = {
+        'dspace_records': 0,
+        'dspace_deleted': 0,
+        'graph_links': 0,
+        'missing': 0,
+        'orphans': 0,
+        'reindexed': 0,
+        'failed': 0,
+        'deleted': 0
+    }
+
+    with tempfile.TemporaryDirectory(dir=settings.RECONCILE_TMP_DIR) as directory:
+        dspace_sorter = ExternalSorter(directory)
+        graph_sorter = ExternalSorter(directory)
+
+        await asyncio.gather(
+            asyncio.to_thread(collect_dspace_links, source, dspace_sorter, metrics),
+            collect_graph_links(connections, source, graph_sorter, metrics)
+        )
+
+        # count the differences first, so that the deletion can be checked against the limit
+        for kind, link in iter_differences(dspace_sorter.iter_sorted(), graph_sorter.iter_sorted()):
+            metrics['orphans' if kind == 'orphan' else 'missing'] += 1
+
+        allow_delete = metrics['orphans'] <= settings.RECONCILE_MAX_DELETE_FRACTION * max(metrics['graph_links'], 1)
+        if not allow_delete:
+            logger.error('too many orphans in ' + source['name'] + ', ' + str(metrics['orphans']) + ' of ' +
+                         str(metrics['graph_links']) + ' publications are not deleted')
+
+        batches = {'missing': [], 'orphan': []}
+        for kind, link in iter_differences(dspace_sorter.iter_sorted(), graph_sorter.iter_sorted()):
+            batches[kind].append(link)
+            if len(batches[kind]) >= settings.RECONCILE_BATCH_SIZE:
+                await fix_batch(connections, source, kind, batches[kind], metrics, allow_delete)
+                batches[kind] = []
+        for kind in batches:
+            if len(batches[kind]) > 0:
+                await fix_batch(connections, source, kind, batches[kind], metrics, allow_delete)
+
+    metrics['duration'] = round(time.time() - started, 1)
+    metrics['finished'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    # the metrics of the last run are kept with the state of the source
+    state = watermark.load_state(source['name'])
+    state['reconcile'] = metrics
+    watermark.save_state(source['name'], state)
+
+    logger.info('reconcile metrics ' + source['name'] + ' ' + json.dumps(metrics))
+    return metrics
@@ -0,0 +1,112 @@
+# integration packages
+import logging
+
+from datetime import datetime, timedelta
+
+# start
+logger = logging.getLogger('extract-dspace-schedule')
+
+# ranges of the five cron fields: minute, hour, day of month, month, day of week (0 and 7 are sunday)
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def parse_field(field, first, last):
+    """
+    The parse_field function expands a single cron field into the set of matching values.
+    It supports `*`, single values, ranges `a-b`, lists `a,b`, and steps `*/n` or `a-b/n`.
+
+    :param field: The cron field i.e. '*/15' or '1-5'
+    :param first: The smallest value of the field
+    :param last: The largest value of the field
+    :return: A set of values
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = first, last
+        elif '-' in part:
+            start, end = [int(value) for value in part.split('-')]
+        else:
+            start = end = int(part)
+        if start < first or end > last or step < 1:
+            raise ValueError('invalid cron field: ' + field)
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expression):
+    """
+    The parse_cron function parses a cron expression with five fields.
+
+    :param expression: The cron expression i.e. '0 3 * * *' for every day at 3:00
+    :return: A dictionary with the matching values and the restricted day fields
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError('cron expression needs five fields: ' + expression)
+    minutes, hours, days, months, weekdays = [parse_field(field, *FIELD_RANGES[i]) for i, field in enumerate(fields)]
+    if 7 in weekdays:
+        weekdays.add(0)
+    return {
+        'minutes': minutes,
+        'hours': hours,
+        'days': days,
+        'months': months,
+        'weekdays': weekdays,
+        # like cron, if both day fields are restricted a day matches either of them
+        'days_restricted': fields[2] != '*',
+        'weekdays_restricted': fields[4] != '*'
+    }
+
+
+def day_matches(cron, moment):
+    day = moment.day in cron['days']
+    weekday = (moment.isoweekday() % 7) in cron['weekdays']
+    if cron['days_restricted'] and cron['weekdays_restricted']:
+        return day or weekday
+    return day and weekday
+
+
+def next_run(expression, after):
+    """
+    The next_run function returns the first moment after the given time that matches the expression.
+
+    :param expression: The cron expression
+    :param after: A datetime
+    :return: The datetime of the next run
+    """
+    cron = parse_cron(expression)
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = moment + timedelta(days=366 * 5)
+
+    while moment < limit:
+        if moment.month not in cron['months']:
+            moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+        elif not day_matches(cron, moment):
+            moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+        elif moment.hour not in cron['hours']:
+            moment = moment.replace(minute=0) + timedelta(hours=1)
+        elif moment.minute not in cron['minutes']:
+            moment = moment + timedelta(minutes=1)
+        else:
+            return moment
+    raise ValueError('cron expression never matches: ' + expression)
+
+
+def seconds_until_next_run(expression, interval, now=None):
+    """
+    The seconds_until_next_run function returns the time to wait for the next scheduled harvest.
+    Without a cron expression the harvest is repeated after a fixed interval.
+
+    :param expression: The cron expression / else an empty string
+    :param interval: The interval in seconds, if there is no cron expression
+    :return: The number of seconds to wait
+    """
+    if not expression:
+        return interval
+    now = now or datetime.now()
+    return (next_run(expression, now) - now).total_seconds()
@@ -15,7 +15,49 @@ _settings = {
     "MQ_HEARTBEAT": int(os.getenv("MQ_HEARTBEAT", 6000)),
     "MQ_TIMEOUT": int(os.getenv("MQ_TIMEOUT", 3600)),
     "MQ_USER": os.getenv("MQ_USER", "extraction-dspace"),
-    "MQ_PASS": os.getenv("MQ_PASS", "guest")
+    "MQ_PASS": os.getenv("MQ_PASS", "guest"),
+    "STATE_DIR": os.getenv("STATE_DIR", "/data"),
+    "OAI_SOURCES": os.getenv("OAI_SOURCES"), # json list of sources, see README.md
+    "DB_CONCURRENCY": int(os.getenv("DB_CONCURRENCY", 4)),
+    "LEASE_STORE": os.getenv("LEASE_STORE", "none"), # none, memory, or file
+    "LEASE_FILE": os.getenv("LEASE_FILE", "/data/leases.json"),
+    "LEASE_TTL": int(os.getenv("LEASE_TTL", 300)),
+    "LEASE_POLL_INTERVAL": int(os.getenv("LEASE_POLL_INTERVAL", 60)),
+    "LEASE_MAX_BACKOFF": int(os.getenv("LEASE_MAX_BACKOFF", 21600)),
+    "WORK_UNIT_DAYS": int(os.getenv("WORK_UNIT_DAYS", 30)),
+    "PROFILE_ITERATIONS": int(os.getenv("PROFILE_ITERATIONS", 0)),
+    "PROFILE_SIGNAL_ITERATIONS": int(os.getenv("PROFILE_SIGNAL_ITERATIONS", 5)),
+    "PROFILE_DIR": os.getenv("PROFILE_DIR", "/data/profiles"),
+    "PROFILE_KEEP": int(os.getenv("PROFILE_KEEP", 20)),
+    "PROFILE_TOP": int(os.getenv("PROFILE_TOP", 40)),
+    "PROFILE_TRACEMALLOC_FRAMES": int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", 10)),
+    "MQ_IMPORTER_QUEUE": os.getenv("MQ_IMPORTER_QUEUE", ""),
+    "MQ_HIGH_WATERMARK": int(os.getenv("MQ_HIGH_WATERMARK", 5000)),
+    "MQ_LOW_WATERMARK": int(os.getenv("MQ_LOW_WATERMARK", 1000)),
+    "MQ_BACKPRESSURE_POLL": int(os.getenv("MQ_BACKPRESSURE_POLL", 10)),
+    "HARVEST_SCHEDULE": os.getenv("HARVEST_SCHEDULE", ""), # cron expression, i.e. "0 3 * * *"
+    "MQ_CONTROL_QUEUE": os.getenv("MQ_CONTROL_QUEUE", ""),
+    "MQ_CONTROL_ROUTING_KEY": os.getenv("MQ_CONTROL_ROUTING_KEY", "extraction-dspace.control"),
+    "MQ_CONTROL_POLL": int(os.getenv("MQ_CONTROL_POLL", 5)),
+    "PIPELINE_QUEUE_SIZE": int(os.getenv("PIPELINE_QUEUE_SIZE", 4)),
+    "PIPELINE_PARSE_WORKERS": int(os.getenv("PIPELINE_PARSE_WORKERS", 2)),
+    "PIPELINE_WRITE_WORKERS": int(os.getenv("PIPELINE_WRITE_WORKERS", 4)),
+    "HARVEST_CURSOR_MAX_AGE": int(os.getenv("HARVEST_CURSOR_MAX_AGE", 3600)),
+    "RECONCILE_SCHEDULE": os.getenv("RECONCILE_SCHEDULE", ""), # cron expression, i.e. "0 2 * * 0"
+    "RECONCILE_PAGE_SIZE": int(os.getenv("RECONCILE_PAGE_SIZE", 1000)),
+    "RECONCILE_BATCH_SIZE": int(os.getenv("RECONCILE_BATCH_SIZE", 100)),
+    "RECONCILE_SORT_CHUNK": int(os.getenv("RECONCILE_SORT_CHUNK", 100000)),
+    "RECONCILE_MAX_DELETE_FRACTION": float(os.getenv("RECONCILE_MAX_DELETE_FRACTION", 0.05)),
+    "RECONCILE_TMP_DIR": os.getenv("RECONCILE_TMP_DIR") or None, # None for the system default
+    "EXPORT_DIR": os.getenv("EXPORT_DIR", ""),
+    "EXPORT_ROWS_PER_FILE": int(os.getenv("EXPORT_ROWS_PER_FILE", 50000)),
+    "EXPORT_COMPRESSION": os.getenv("EXPORT_COMPRESSION", "zstd"),
+    "TRACE_SAMPLE_RATE": float(os.getenv("TRACE_SAMPLE_RATE", 0)),
+    "TRACE_FILE": os.getenv("TRACE_FILE", "/data/traces/traces.jsonl"),
+    "TRACE_FILE_MAX_BYTES": int(os.getenv("TRACE_FILE_MAX_BYTES", 10485760)),
+    "TRACE_FILE_BACKUPS": int(os.getenv("TRACE_FILE_BACKUPS", 5)),
+    "TRACE_ENDPOINT": os.getenv("TRACE_ENDPOINT", ""),
+    "TRACE_SERVICE_NAME": os.getenv("TRACE_SERVICE_NAME", "extraction-dspace")
 }
 
 if os.path.exists('/etc/app/config.json'):
@@ -44,6 +86,48 @@ MQ_HEARTBEAT = _settings['MQ_HEARTBEAT']
 MQ_TIMEOUT = _settings['MQ_TIMEOUT']
 MQ_USER = _settings['MQ_USER']
 MQ_PASS = _settings['MQ_PASS']
+STATE_DIR = _settings['STATE_DIR'] # directory for the local state, i.e. the harvest watermarks
+OAI_SOURCES = _settings['OAI_SOURCES'] # list of oai-pmh sources, None to harvest only TARGET_HOST/TARGET_PATH
+DB_CONCURRENCY = _settings['DB_CONCURRENCY'] # max number of concurrent requests to the graph database
+LEASE_STORE = _settings['LEASE_STORE'] # coordination store of the work units, none to harvest without work units
+LEASE_FILE = _settings['LEASE_FILE'] # json file of the file lease store, must be on a volume shared by all replicas
+LEASE_TTL = _settings['LEASE_TTL'] # lifetime of a lease without heartbeat
+LEASE_POLL_INTERVAL = _settings['LEASE_POLL_INTERVAL'] # time to wait if there is no work unit to claim
+LEASE_MAX_BACKOFF = _settings['LEASE_MAX_BACKOFF'] # max delay before a failed work unit is retried
+WORK_UNIT_DAYS = _settings['WORK_UNIT_DAYS'] # length of the date window of a work unit
+PROFILE_ITERATIONS = _settings['PROFILE_ITERATIONS'] # number of iterations to profile after start, 0 for none
+PROFILE_SIGNAL_ITERATIONS = _settings['PROFILE_SIGNAL_ITERATIONS'] # number of iterations to profile after SIGUSR1
+PROFILE_DIR = _settings['PROFILE_DIR'] # directory for the profiles
+PROFILE_KEEP = _settings['PROFILE_KEEP'] # number of profiled iterations to keep in PROFILE_DIR
+PROFILE_TOP = _settings['PROFILE_TOP'] # number of functions and allocations in the profile summaries
+PROFILE_TRACEMALLOC_FRAMES = _settings['PROFILE_TRACEMALLOC_FRAMES'] # depth of the allocation tracebacks
+MQ_IMPORTER_QUEUE = _settings['MQ_IMPORTER_QUEUE'] # queue of the importer to watch, empty for no backpressure
+MQ_HIGH_WATERMARK = _settings['MQ_HIGH_WATERMARK'] # pause the harvest at this number of messages in the importer queue
+MQ_LOW_WATERMARK = _settings['MQ_LOW_WATERMARK'] # resume the harvest at this number of messages in the importer queue
+MQ_BACKPRESSURE_POLL = _settings['MQ_BACKPRESSURE_POLL'] # time between two checks of the importer queue
+HARVEST_SCHEDULE = _settings['HARVEST_SCHEDULE'] # cron expression of the harvests, empty to wait PUBDB_UPDATE_INTERVAL
+MQ_CONTROL_QUEUE = _settings['MQ_CONTROL_QUEUE'] # queue for control commands, empty for no control queue
+MQ_CONTROL_ROUTING_KEY = _settings['MQ_CONTROL_ROUTING_KEY'] # routing key of the control commands on MQ_EXCHANGE
+MQ_CONTROL_POLL = _settings['MQ_CONTROL_POLL'] # time between two polls of an empty control queue
+PIPELINE_QUEUE_SIZE = _settings['PIPELINE_QUEUE_SIZE'] # max number of chunks waiting between two stages of the pipeline
+PIPELINE_PARSE_WORKERS = _settings['PIPELINE_PARSE_WORKERS'] # number of chunks parsed at the same time
+PIPELINE_WRITE_WORKERS = _settings['PIPELINE_WRITE_WORKERS'] # number of chunks written to the graph database at the same time
+HARVEST_CURSOR_MAX_AGE = _settings['HARVEST_CURSOR_MAX_AGE'] # max age in seconds of a resumption token to resume an interrupted harvest
+RECONCILE_SCHEDULE = _settings['RECONCILE_SCHEDULE'] # cron expression of the reconciliation, empty for no scheduled reconciliation
+RECONCILE_PAGE_SIZE = _settings['RECONCILE_PAGE_SIZE'] # number of links per query to the graph database
+RECONCILE_BATCH_SIZE = _settings['RECONCILE_BATCH_SIZE'] # number of orphans or missing records fixed together
+RECONCILE_SORT_CHUNK = _settings['RECONCILE_SORT_CHUNK'] # number of links sorted in memory before they are written to a temporary file
+RECONCILE_MAX_DELETE_FRACTION = _settings['RECONCILE_MAX_DELETE_FRACTION'] # max share of the publications of a source that may be deleted as orphans
+RECONCILE_TMP_DIR = _settings['RECONCILE_TMP_DIR'] # directory for the temporary files of the reconciliation
+EXPORT_DIR = _settings['EXPORT_DIR'] # directory for the parquet export, empty for no export
+EXPORT_ROWS_PER_FILE = _settings['EXPORT_ROWS_PER_FILE'] # max number of rows in a parquet file
+EXPORT_COMPRESSION = _settings['EXPORT_COMPRESSION'] # compression of the parquet files
+TRACE_SAMPLE_RATE = _settings['TRACE_SAMPLE_RATE'] # share of the chunks that are traced, 0 for no tracing
+TRACE_FILE = _settings['TRACE_FILE'] # json lines file for the traces, empty for no file
+TRACE_FILE_MAX_BYTES = _settings['TRACE_FILE_MAX_BYTES'] # size at which the trace file is rotated
+TRACE_FILE_BACKUPS = _settings['TRACE_FILE_BACKUPS'] # number of rotated trace files to keep
+TRACE_ENDPOINT = _settings['TRACE_ENDPOINT'] # url of an OTLP/HTTP json collector, empty for no collector
+TRACE_SERVICE_NAME = _settings['TRACE_SERVICE_NAME'] # service.name of the traces
 
 # helper dictionary to get the departmental affiliation
 
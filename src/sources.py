@@ -0,0 +1,74 @@
+# integration packages
+import settings
+import logging
+
+import json
+from urllib.parse import urlparse
+
+# start
+logger = logging.getLogger('extract-dspace-sources')
+
+ZHAW_LINK_TEMPLATE = 'https://digitalcollection.zhaw.ch/handle/{handle}'
+
+
+def gen_source_dict(config):
+    """
+    The gen_source_dict function completes the configuration of a single OAI-PMH source.
+    Missing values are taken from the global settings, so a source only needs a host. The links of
+    the records default to the handle server of the host (`<host>/handle/{handle}`), and without
+    department_collections no departments are assigned.
+
+    :param config: A dictionary with the configuration of the source
+    :return: A dictionary with all values needed to harvest the source
+    """
+    if 'host' not in config:
+        raise ValueError('OAI source without host: ' + json.dumps(config))
+
+    oai_url = config['host'] + config.get('path', settings.TARGET_PATH)
+
+    return {
+        'name': config.get('name', oai_url),
+        'oai_url': oai_url,
+        'link_template': config.get('link_template', config['host'].rstrip('/') + '/handle/{handle}'),
+        # prefix of the oai identifiers, the handle of a link is appended to reindex the record
+        'identifier_prefix': config.get('identifier_prefix', 'oai:' + urlparse(config['host']).hostname + ':'),
+        # the department mapping of settings.py belongs to the ZHAW digital collection only
+        'department_collections': config.get('department_collections', {}),
+        'sets': config.get('sets', []), # sets to split the work units, an empty list harvests the whole repository
+        'request_interval': int(config.get('request_interval', settings.OAI_REQUEST_INTERVAL)),
+        'update_interval': int(config.get('update_interval', settings.PUBDB_UPDATE_INTERVAL)),
+        # only the legacy single source may fall back to the latest dateUpdate in the graph database,
+        # for any other source this timestamp would belong to a different repository
+        'graph_fallback': bool(config.get('graph_fallback', False))
+    }
+
+
+def get_sources():
+    """
+    The get_sources function returns the list of OAI-PMH sources to harvest.
+    The sources are defined by OAI_SOURCES, either as a list in the config file or as a json string
+    in the environment. Without OAI_SOURCES the single source TARGET_HOST/TARGET_PATH is used.
+
+    :return: A list of source dictionaries
+    """
+    source_configs = settings.OAI_SOURCES
+
+    if source_configs is None or len(source_configs) == 0:
+        return [gen_source_dict({
+            'host': settings.TARGET_HOST,
+            'path': settings.TARGET_PATH,
+            'link_template': ZHAW_LINK_TEMPLATE,
+            'department_collections': settings.DepartmentCollections,
+            'graph_fallback': True
+        })]
+
+    if isinstance(source_configs, str):
+        source_configs = json.loads(source_configs)
+
+    sources = [gen_source_dict(config) for config in source_configs]
+
+    names = [source['name'] for source in sources]
+    if len(set(names)) != len(names):
+        raise ValueError('OAI source names must be unique: ' + ', '.join(names))
+
+    return sources
@@ -0,0 +1,197 @@
+# integration packages
+import settings
+import logging
+import logging.handlers
+
+import os
+import json
+import time
+import random
+import requests
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# start
+logger = logging.getLogger('extract-dspace-tracing')
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def gen_attribute(key, value):
+    """
+    The gen_attribute function converts a value into an OpenTelemetry (OTLP/JSON) attribute.
+    """
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class Span:
+    """
+    The Span class is a single timed operation of a trace. A span without parent starts a new trace.
+    """
+
+    sampled = True
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else '%032x' % random.getrandbits(128)
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.message = None
+        self.start = time.time_ns()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = STATUS_ERROR
+        self.message = repr(error)
+
+    def end(self):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        self.tracer.on_end(self)
+
+    def to_json(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1, # internal
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end_time),
+            'attributes': [gen_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status}
+        }
+        if self.parent_id is not None:
+            span['parentSpanId'] = self.parent_id
+        if self.message is not None:
+            span['status']['message'] = self.message
+        return span
+
+
+class NoopSpan:
+    """
+    The NoopSpan class stands in for the spans of a trace that is not sampled.
+    """
+
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer:
+    """
+    The Tracer class creates the spans of the harvest and exports them as OpenTelemetry JSON
+    (OTLP/JSON `ExportTraceServiceRequest`).
+
+    Each harvested chunk is a trace, which is sampled with TRACE_SAMPLE_RATE when the chunk span
+    is started. The spans of a sampled trace are collected until its root span ends and are then
+    appended as one json line to TRACE_FILE, which is rotated at TRACE_FILE_MAX_BYTES, and posted to
+    TRACE_ENDPOINT (i.e. http://localhost:4318/v1/traces) if it is set. Spans of traces that are not
+    sampled are NOOP_SPAN, so tracing costs close to nothing while it is off.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.finished = {} # trace id: ended spans
+        self.writer = None
+        self.poster = None
+
+    def start_span(self, name, parent=None, attributes=None):
+        """
+        The start_span function starts a span. A span without parent is the root of a new trace
+        and decides if the trace is sampled, a span with parent follows the parent.
+
+        :return: A Span / else NOOP_SPAN
+        """
+        if parent is None:
+            if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+                return NOOP_SPAN
+        elif not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent, attributes)
+
+    @contextmanager
+    def span(self, name, parent=None, attributes=None):
+        """
+        The span function runs a block in a span and records an error of the block.
+        """
+        span = self.start_span(name, parent, attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end()
+
+    def on_end(self, span):
+        if len(self.finished) > 100 and span.trace_id not in self.finished:
+            # the root spans of these traces will never end, i.e. because their harvest failed
+            logger.warning('drop ' + str(len(self.finished)) + ' incomplete traces')
+            self.finished = {}
+        self.finished.setdefault(span.trace_id, []).append(span)
+        if span.parent_id is None:
+            self.export(self.finished.pop(span.trace_id))
+
+    def export(self, spans):
+        payload = json.dumps({
+            'resourceSpans': [{
+                'resource': {'attributes': [gen_attribute('service.name', settings.TRACE_SERVICE_NAME)]},
+                'scopeSpans': [{
+                    'scope': {'name': 'extract-dspace'},
+                    'spans': [span.to_json() for span in spans]
+                }]
+            }]
+        })
+
+        if settings.TRACE_FILE:
+            self.get_writer().info(payload)
+        if settings.TRACE_ENDPOINT:
+            if self.poster is None:
+                self.poster = ThreadPoolExecutor(max_workers=1)
+            self.poster.submit(self.post, payload)
+
+    def get_writer(self):
+        # a logger with a rotating file handler writes one trace per line
+        if self.writer is None:
+            os.makedirs(os.path.dirname(settings.TRACE_FILE) or '.', exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(settings.TRACE_FILE, maxBytes=settings.TRACE_FILE_MAX_BYTES,
+                                                           backupCount=settings.TRACE_FILE_BACKUPS)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.writer = logging.getLogger('extract-dspace-traces')
+            self.writer.propagate = False
+            self.writer.setLevel(logging.INFO)
+            self.writer.addHandler(handler)
+        return self.writer
+
+    def post(self, payload):
+        try:
+            requests.post(settings.TRACE_ENDPOINT, data=payload, headers={'Content-Type': 'application/json'}, timeout=5)
+        except requests.RequestException as e:
+            logger.warning('cannot post trace: ' + str(e))
+
+
+tracer = Tracer(settings.TRACE_SAMPLE_RATE)
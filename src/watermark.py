@@ -0,0 +1,140 @@
+# integration packages
+import settings
+import logging
+
+# packages for the local state store
+import os
+import json
+import time
+
+# start
+logger = logging.getLogger('extract-dspace-watermark')
+
+
+def get_state_file(source_name):
+    """
+    The get_state_file function returns the path of the local state file of a source.
+    The source name is reduced to a file system safe name, so that an url can be used as name.
+
+    :param source_name: Name of the harvested source, i.e. the url to the oai-pmh api
+    :return: The path to the state file of the source
+    """
+    safe_name = "".join(c if c.isalnum() or c in '-_' else '_' for c in source_name)
+    return os.path.join(settings.STATE_DIR, 'watermark_' + safe_name + '.json')
+
+
+def load_state(source_name):
+    """
+    The load_state function reads the local state of a source.
+    A missing or broken state file is treated as an empty state.
+
+    :param source_name: Name of the harvested source
+    :return: A dictionary with the state of the source
+    """
+    state_file = get_state_file(source_name)
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.exception('cannot read state file ' + state_file)
+        return {}
+
+
+def save_state(source_name, state):
+    """
+    The save_state function writes the local state of a source. The file is replaced atomically,
+    so that a crash during the write never leaves a half written watermark behind.
+
+    :param source_name: Name of the harvested source
+    :param state: A dictionary with the state of the source
+    """
+    state_file = get_state_file(source_name)
+    os.makedirs(settings.STATE_DIR, exist_ok=True)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
+def load_watermark(source_name):
+    """
+    The load_watermark function returns the watermark of the last fully committed harvest.
+    The watermark is the responseDate of the first request of that harvest, so it can be used as
+    the inclusive `from` of the next harvest without missing records that changed during the harvest.
+
+    :param source_name: Name of the harvested source
+    :return: The watermark datestamp / else None
+    """
+    return load_state(source_name).get('watermark')
+
+
+def load_cursor(source_name):
+    """
+    The load_cursor function returns the resumption token after the last published chunk of an
+    interrupted harvest, so the harvest can be resumed instead of started again. Resumption tokens
+    expire, so a cursor older than HARVEST_CURSOR_MAX_AGE is not returned.
+
+    :param source_name: Name of the harvested source
+    :return: The resumption token / else None
+    """
+    state = load_state(source_name)
+    if state.get('pending') is None or state.get('cursor') is None:
+        return None
+    if time.time() - state.get('cursor_saved', 0) > settings.HARVEST_CURSOR_MAX_AGE:
+        logger.info('Resumption token of ' + source_name + ' is too old to resume the harvest')
+        return None
+    return state['cursor']
+
+
+def begin_harvest(source_name):
+    """
+    The begin_harvest function forgets the pending watermark and the cursor of an earlier
+    harvest that has not been completed.
+
+    :param source_name: Name of the harvested source
+    """
+    state = load_state(source_name)
+    state.pop('pending', None)
+    state.pop('cursor', None)
+    state.pop('cursor_saved', None)
+    save_state(source_name, state)
+
+
+def save_checkpoint(source_name, response_date, cursor):
+    """
+    The save_checkpoint function is called after a chunk and all chunks before it have been
+    published. It remembers the responseDate of the first request of the harvest, which becomes
+    the watermark after the harvest has been fully committed, and the resumption token of the next chunk.
+
+    :param source_name: Name of the harvested source
+    :param response_date: The responseDate of the first OAI-PMH response of the harvest
+    :param cursor: The resumption token of the next chunk / else None after the last chunk
+    """
+    state = load_state(source_name)
+    if state.get('pending') is None:
+        state['pending'] = response_date
+    state['cursor'] = cursor
+    state['cursor_saved'] = time.time()
+    save_state(source_name, state)
+
+
+def commit_harvest(source_name):
+    """
+    The commit_harvest function promotes the pending watermark of a completed harvest.
+    Nothing happens if there is no pending harvest.
+
+    :param source_name: Name of the harvested source
+    :return: The new watermark / else None
+    """
+    state = load_state(source_name)
+    pending = state.pop('pending', None)
+    state.pop('cursor', None)
+    state.pop('cursor_saved', None)
+    if pending is None:
+        return None
+    state['watermark'] = pending
+    save_state(source_name, state)
+    logger.info('Committed watermark ' + pending + ' for ' + source_name)
+    return pending
@@ -0,0 +1,119 @@
+# integration packages
+import settings
+import logging
+import pipeline
+
+import asyncio
+from datetime import datetime, timezone
+
+# start
+logger = logging.getLogger('extract-dspace-workunits')
+
+DATESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_datestamp(datestamp):
+    """
+    The parse_datestamp function converts an OAI-PMH datestamp with day or second granularity
+    into a unix timestamp.
+
+    :param datestamp: A datestamp i.e. '2023-01-13' or '2023-01-13T10:00:00Z'
+    :return: The unix timestamp
+    """
+    if len(datestamp) == 10:
+        datestamp = datestamp + 'T00:00:00Z'
+    return int(datetime.strptime(datestamp, DATESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+
+
+def format_datestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(DATESTAMP_FORMAT)
+
+
+def plan_units(source, earliest, now):
+    """
+    The plan_units function splits the harvest of a source into work units of set x date window.
+    The windows are aligned to multiples of WORK_UNIT_DAYS since the epoch, so all replicas plan
+    the same units with the same ids. The last window reaches beyond now.
+
+    :param source: The source dictionary of the repository
+    :param earliest: The earliest datestamp of the repository
+    :param now: The current unix timestamp
+    :return: A list of unit dictionaries
+    """
+    window = settings.WORK_UNIT_DAYS * 86400
+    start = parse_datestamp(earliest) // window * window
+
+    units = []
+    for set_spec in source['sets'] or [None]:
+        window_start = start
+        while window_start <= now:
+            units.append({
+                'id': source['name'] + '|' + (set_spec or '*') + '|' + format_datestamp(window_start),
+                'source': source['name'],
+                'set': set_spec,
+                'from': format_datestamp(window_start),
+                'until': format_datestamp(window_start + window - 1) # until is inclusive
+            })
+            window_start += window
+    return units
+
+
+async def keep_lease(store, owner, unit, lease):
+    """
+    The keep_lease function renews the lease of a unit until it is cancelled.
+    If the lease is lost, i.e. because it expired and another replica claimed the unit,
+    the harvest of the unit is stopped after the current chunk.
+    """
+    while lease['held']:
+        await asyncio.sleep(settings.LEASE_TTL / 3)
+        lease['held'] = store.heartbeat(unit['id'], owner, settings.LEASE_TTL)
+        if not lease['held']:
+            logger.warning('lost lease of ' + unit['id'])
+
+
+async def run_unit(connections, source, store, owner, unit, stopping=None):
+    """
+    The run_unit function harvests all chunks of a leased work unit and records its completion.
+    A window that ended before the harvest started is done for good. The window that contains the
+    harvest time is completed for now and becomes due again after the update interval of the source.
+
+    :param connections: Shared connections to the graph database and the message queue
+    :param source: The source dictionary of the repository
+    :param store: The LeaseStore that holds the unit
+    :param owner: Id of this replica
+    :param unit: The leased unit dictionary
+    :param stopping: An asyncio.Event that is set on shutdown
+    :return: True if the unit has been completed / else False
+    """
+    logger.info('run work unit ' + unit['id'])
+
+    lease = {'held': True}
+    heartbeat = asyncio.create_task(keep_lease(store, owner, unit, lease))
+
+    request = {'from': unit['from'], 'until': unit['until'], 'set': unit['set']}
+
+    def checkpoint(result, chunk):
+        # stop fetching if another replica has taken over the unit
+        return lease['held']
+
+    try:
+        result = await pipeline.run_pipeline(connections, source, request, checkpoint=checkpoint, stopping=stopping)
+    except Exception:
+        logger.exception('failed work unit ' + unit['id'])
+        store.release(unit['id'], owner)
+        return False
+    finally:
+        lease['held'] = False
+        heartbeat.cancel()
+
+    if not result['complete']:
+        # a unit that is stopped by the shutdown has not failed
+        store.release(unit['id'], owner, failed=result['error'] is not None or stopping is None or not stopping.is_set())
+        return False
+
+    final = unit['until'] < result['response_date']
+    completed = store.complete(unit['id'], owner, final=final, retry_after=source['update_interval'])
+
+    logger.info('Number of inserted records in ' + unit['id'] + ': ' + str(result['inserted_records']))
+    logger.info('Number of deleted records in ' + unit['id'] + ': ' + str(result['deleted_records']))
+    return completed